@@ -1,6 +1,14 @@
+import os
+import json
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyarrow import csv as pa_csv
 from pathlib import Path
+from string import Template
+from concurrent.futures import ThreadPoolExecutor
 from huggingface_hub import hf_hub_download
 
 
@@ -10,55 +18,266 @@ st.set_page_config(
     layout='wide',
     menu_items=None
 )
-@st.cache_data()
-def load_sales_data():
-    """Download and load Sales data from Hugging Face."""
-    filename = "Sales.csv"
-    repo_id = "lemoninabag/Sales"
-    
-    hf_hub_download(
+
+time_periods = {
+    1: "1 month",
+    3: "3 months",
+    6: "6 months",
+    12: "1 year",
+    24: "2 years",
+    36: "3 years",
+    60: "5 years",
+}
+
+DATA_VERSION = '2024-10-29'
+
+PARQUET_VERSION = 3
+
+SALES_COLUMNS = ['master_project_en', 'property_sub_type_en', 'rooms_en', 'instance_date', 'actual_worth']
+RENTAL_COLUMNS = ['master_project_en', 'ejari_property_type_en', 'ejari_property_sub_type_id', 'contract_start_date', 'annual_amount']
+
+NULL_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+]
+
+TIMESTAMP_PARSERS = [
+    pa_csv.ISO8601,
+    '%d-%m-%Y',
+    '%d-%m-%Y %H:%M',
+    '%d-%m-%Y %H:%M:%S',
+    '%m/%d/%Y',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %I:%M:%S %p'
+]
+
+def fetch_parquet(repo_id, filename, columns, column_types):
+    """Download a CSV dataset from Hugging Face and transcode it to Parquet when it changes."""
+    csv_path = Path(hf_hub_download(
         repo_id=repo_id,
         filename=filename,
         repo_type="dataset",
         local_dir="./data",  
         token=st.secrets["hf_key"]  
+    ))
+    parquet_path = csv_path.with_name(f'{csv_path.stem}.v{PARQUET_VERSION}.parquet')
+    if parquet_path.exists() and parquet_path.stat().st_mtime >= csv_path.stat().st_mtime:
+        return parquet_path
+
+    with pa.memory_map(str(csv_path)) as source:
+        table = pa_csv.read_csv(
+            source,
+            convert_options=pa_csv.ConvertOptions(
+                column_types=column_types,
+                include_columns=columns,
+                null_values=NULL_VALUES,
+                timestamp_parsers=TIMESTAMP_PARSERS,
+                strings_can_be_null=True
+            )
+        )
+    for index, field in enumerate(table.schema):
+        if pa.types.is_string(field.type):
+            trimmed = pc.utf8_trim_whitespace(table[field.name])
+            trimmed = pc.if_else(pc.equal(trimmed, ''), pa.scalar(None, field.type), trimmed)
+            table = table.set_column(index, field.name, trimmed)
+    file_order = {
+        field.name: pc.drop_null(pc.unique(table[field.name])).to_pylist()
+        for field in table.schema
+        if pa.types.is_string(field.type)
+    }
+
+    temp_path = parquet_path.with_suffix('.parquet.tmp')
+    pq.write_table(
+        table.sort_by('master_project_en').replace_schema_metadata({'file_order': json.dumps(file_order)}),
+        temp_path,
+        compression='zstd',
+        row_group_size=200_000
+    )
+    os.replace(temp_path, parquet_path)
+    return parquet_path
+
+@st.cache_resource(show_spinner=False)
+def fetch_datasets():
+    """Fetch the Sales and Rentals datasets in parallel, returning their Parquet paths."""
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        sales = executor.submit(
+            fetch_parquet,
+            "lemoninabag/Sales",
+            "Sales.csv",
+            SALES_COLUMNS,
+            {'instance_date': pa.timestamp('ns'), 'actual_worth': pa.float32()}
+        )
+        rentals = executor.submit(
+            fetch_parquet,
+            "lemoninabag/Rentals",
+            "Rentals.csv",
+            RENTAL_COLUMNS,
+            {'contract_start_date': pa.timestamp('ns'), 'annual_amount': pa.float32()}
+        )
+        return {'Sales': sales.result(), 'Rentals': rentals.result()}
+
+def earliest_date():
+    """Oldest date reachable with the longest selectable time period."""
+    return pd.Timestamp.today() - pd.DateOffset(months=max(time_periods))
+
+def ordered_categories(series, order=None):
+    """Drop unused categories and order the rest alphabetically, or as listed in order."""
+    series = series.cat.remove_unused_categories()
+    if order is None:
+        return series.cat.reorder_categories(sorted(series.cat.categories))
+    present = set(series.cat.categories)
+    return series.cat.reorder_categories([value for value in order if value in present])
+
+def totals_by_date(df, keys, date_column, value_column):
+    """Sum, non-null count and row count of a value per key combination and date, sorted for slicing."""
+    values = df[value_column].astype('float64')
+    return values.groupby(
+        [df[column] for column in keys + [date_column]],
+        sort=True,
+        observed=True
+    ).agg(['sum', 'count', 'size'])
+
+def totals_mean(totals):
+    """Mean of the summed values, NaN when none of them are present."""
+    count = totals['count'].sum()
+    return totals['sum'].sum() / count if count > 0 else float('nan')
+
+def rows_for_areas(df, areas):
+    """Rows of an area-indexed frame for the given areas, skipping areas it lacks."""
+    return df.loc[df.index.intersection(areas)]
+
+def date_window(totals, key, min_date):
+    """Totals for one key combination dated on or after min_date."""
+    if key not in totals.index:
+        return totals.iloc[:0]
+    return totals.loc[key].loc[min_date:]
+
+@st.cache_data(persist="disk", show_spinner=False)
+def load_sales_data(data_version, parquet_version):
+    """Download and load Sales data from Hugging Face."""
+    file_path = fetch_datasets()['Sales']
+    key_columns = ['master_project_en', 'property_sub_type_en', 'rooms_en']
+    real_estate_df = pq.read_table(
+        file_path,
+        columns=SALES_COLUMNS,
+        filters=[('instance_date', '>=', earliest_date())],
+        read_dictionary=key_columns,
+        memory_map=True
+    ).to_pandas()
+    file_order = json.loads(pq.read_schema(file_path).metadata[b'file_order'])
+    for column in key_columns:
+        order = file_order[column] if column == 'property_sub_type_en' else None
+        real_estate_df[column] = ordered_categories(real_estate_df[column], order)
+    sales_totals = totals_by_date(
+        real_estate_df,
+        key_columns,
+        'instance_date',
+        'actual_worth'
     )
-    
-    file_path = Path('./data') / filename
-    real_estate_df = pd.read_csv(file_path)
-    
-    real_estate_df['instance_date'] = pd.to_datetime(real_estate_df['instance_date'])
-    real_estate_df['master_project_en'] = real_estate_df['master_project_en'].str.strip()
-    real_estate_df['property_sub_type_en'] = real_estate_df['property_sub_type_en'].str.strip()
-    
-    return real_estate_df
-
-@st.cache_data()
-def load_rental_data():
+
+    real_estate_df = real_estate_df.sort_values('master_project_en', kind='stable').set_index('master_project_en')
+
+    return real_estate_df, sales_totals
+
+@st.cache_data(persist="disk", show_spinner=False)
+def load_rental_data(data_version, parquet_version):
     """Download and load Rentals data from Hugging Face."""
-    filename = "Rentals.csv"
-    repo_id = "lemoninabag/Rentals"
-    
-    hf_hub_download(
-        repo_id=repo_id,
-        filename=filename,
-        repo_type="dataset",
-        local_dir="./data",  
-        token=st.secrets["hf_key"]  
+    file_path = fetch_datasets()['Rentals']
+    key_columns = ['master_project_en', 'ejari_property_type_en', 'ejari_property_sub_type_id']
+    rental_df = pq.read_table(
+        file_path,
+        columns=RENTAL_COLUMNS,
+        filters=[('contract_start_date', '>=', earliest_date())],
+        read_dictionary=key_columns,
+        memory_map=True
+    ).to_pandas()
+    for column in key_columns:
+        rental_df[column] = ordered_categories(rental_df[column])
+    rental_totals = totals_by_date(
+        rental_df,
+        key_columns,
+        'contract_start_date',
+        'annual_amount'
     )
-    
-    file_path = Path('./data') / filename
-    rental_df = pd.read_csv(file_path)
-    
-    rental_df['contract_start_date'] = pd.to_datetime(rental_df['contract_start_date'])
-    rental_df['master_project_en'] = rental_df['master_project_en'].str.strip()
-    rental_df['ejari_property_type_en'] = rental_df['ejari_property_type_en'].str.strip()
-    rental_df['ejari_property_sub_type_id'] = rental_df['ejari_property_sub_type_id'].str.strip()
-    
-    return rental_df
-
-sales_data = load_sales_data()
-rental_data = load_rental_data()
+
+    rental_df = rental_df.sort_values('master_project_en', kind='stable').set_index('master_project_en')
+
+    return rental_df, rental_totals
+
+sales_data, sales_totals = load_sales_data(DATA_VERSION, PARQUET_VERSION)
+rental_data, rental_totals = load_rental_data(DATA_VERSION, PARQUET_VERSION)
+
+@st.cache_data(max_entries=256, ttl="1h", show_spinner=False)
+def compute_metrics(area, property_type, rooms, months_back):
+    """Gross rental yield and average prices for one area, property type and room type."""
+    min_date = pd.Timestamp.today() - pd.DateOffset(months=months_back)
+
+    selection = (area, property_type, rooms)
+    filtered_sales_totals = date_window(sales_totals, selection, min_date)
+    filtered_rental_totals = date_window(rental_totals, selection, min_date)
+
+    if filtered_sales_totals.empty or filtered_rental_totals.empty:
+        return None
+
+    num_sales_records = int(filtered_sales_totals['size'].sum())
+    if num_sales_records > 0:
+        avg_sale_price = totals_mean(filtered_sales_totals)
+    else:
+        avg_sale_price = 0
+
+    num_rental_records = int(filtered_rental_totals['size'].sum())
+    if num_rental_records > 0:
+        avg_rent_price = totals_mean(filtered_rental_totals)
+    else:
+        avg_rent_price = 0
+
+    if avg_rent_price > 0 and avg_sale_price > 0:
+        gross_rental_yield = (avg_rent_price / avg_sale_price) * 100
+    else:
+        gross_rental_yield = 0
+
+    return {
+        'gross_rental_yield': gross_rental_yield,
+        'avg_sale_price': avg_sale_price,
+        'num_sales_records': num_sales_records,
+        'avg_rent_price': avg_rent_price,
+        'num_rental_records': num_rental_records,
+    }
+
+@st.cache_data(max_entries=256, ttl="1h", show_spinner=False)
+def compute_comparison(areas, property_type, rooms, months_back):
+    """Monthly gross rental yield per area, one column per area."""
+    min_date = pd.Timestamp.today() - pd.DateOffset(months=months_back)
+
+    comp_sales_data = rows_for_areas(sales_data, list(areas)).query(
+        "property_sub_type_en == @property_type and "
+        "rooms_en == @rooms and "
+        "instance_date >= @min_date"
+    )
+
+    comp_rental_data = rows_for_areas(rental_data, list(areas)).query(
+        "ejari_property_type_en == @property_type and "
+        "ejari_property_sub_type_id == @rooms and "
+        "contract_start_date >= @min_date"
+    )
+
+    comp_monthly_sales = comp_sales_data.astype({'actual_worth': 'float64'}).groupby(
+        [pd.Grouper(key='instance_date', freq='MS'), 'master_project_en'],
+        observed=True
+    )['actual_worth'].mean().unstack('master_project_en')
+
+    comp_avg_rent_prices = comp_rental_data.astype({'annual_amount': 'float64'}).groupby(
+        'master_project_en',
+        observed=True
+    )['annual_amount'].mean()
+
+    comparison_data = comp_monthly_sales.rdiv(
+        comp_avg_rent_prices.reindex(comp_monthly_sales.columns, fill_value=0),
+        axis='columns'
+    ) * 100
+    comparison_data.columns = comparison_data.columns.astype(str).rename('Area')
+
+    return comparison_data
 
 st.markdown(
     """
@@ -72,150 +291,106 @@ st.markdown(
 
 st.title("Rental Yield Calculator (Beta)")
 
-time_periods = [1, 3, 6, 12, 24, 36, 60]
-months_back = st.select_slider(
-    'Time Period',
-    options=time_periods,
-    value=12,  
-    format_func=lambda x: f"{x} month{'s' if x > 1 else ''}" if x < 12 else f"{x // 12} year{'s' if x // 12 > 1 else ''}"
+YIELD_CARD = Template(
+    """
+    <div style="background-color:#101726;padding:14px;border-radius:10px;text-align:center; margin:3px">
+        <h3 style="color:#C8CAD0;font-size:25px;">Gross Rental Yield</h3>
+        <p style="color:#C8CAD0;font-size:24px;">$gross_rental_yield%</p>
+    </div>
+    """
 )
 
-col1, col2 = st.columns([1, 2])
-
-with col1:
-    area_options = sorted(sales_data['master_project_en'].dropna().unique())
-    default_index = area_options.index('Business Bay')
-    selected_area = st.selectbox("Select Area / Project:", area_options, index=default_index)
-
-    property_type_options = sales_data['property_sub_type_en'].unique()
-    selected_property_type = st.selectbox("Property Type:", property_type_options).strip() 
-    
-    rooms_options = sorted(sales_data['rooms_en'].unique())
-    selected_rooms = st.selectbox("Rooms:", rooms_options, index=0).strip()  
-
-with col2:
-    current_date = pd.Timestamp.today()
-    min_date = current_date - pd.DateOffset(months=months_back)
-
-    filtered_sales_data = sales_data[
-        (sales_data['master_project_en'] == selected_area) &
-        (sales_data['property_sub_type_en'] == selected_property_type) &
-        (sales_data['rooms_en'] == selected_rooms) &
-        (sales_data['instance_date'] >= min_date)
-    ]
-
-    filtered_rental_data = rental_data[
-        (rental_data['master_project_en'] == selected_area) &
-        (rental_data['ejari_property_type_en'] == selected_property_type) &
-        (rental_data['ejari_property_sub_type_id'] == selected_rooms) &
-        (rental_data['contract_start_date'] >= min_date)
-    ]
-
-    if filtered_sales_data.empty or filtered_rental_data.empty:
-        st.error("No sales or rental data available for the selected area, property type, or room type within the selected time period.")
-    else:
-        num_sales_records = len(filtered_sales_data)
-        if num_sales_records > 0:
-            avg_sale_price = filtered_sales_data['actual_worth'].mean()
-            filtered_sales_data = filtered_sales_data.groupby(filtered_sales_data['instance_date'].dt.to_period("M")).mean(numeric_only=True).reset_index()
-            filtered_sales_data['instance_date'] = filtered_sales_data['instance_date'].dt.to_timestamp()
+SALE_PRICE_CARD = Template(
+    """
+    <div style="background-color:#C8CAD0;padding:5px;border-radius:10px;text-align:center; margin:3px">
+        <h3 style="color:#101726;">Avg. Sale Price</h3>
+        <p style="color:#101726;font-size:24px;">AED $avg_sale_price</p>
+        <p style="color:#101726;font-size:15px;">...based on $num_sales_records sales.</p>
+    </div>
+    """
+)
 
-            
-        else:
-            avg_sale_price = 0
+RENT_PRICE_CARD = Template(
+    """
+    <div style="background-color:#C8CAD0;padding:5px;border-radius:10px;text-align:center; margin:3px">
+        <h3 style="color:#101726;">Avg. Rent Price</h3>
+        <p style="color:#101726;font-size:24px;">AED $avg_rent_price</p>
+        <p style="color:#101726;font-size:15px;">...based on $num_rental_records rental contracts.</p>
+    </div>
+    """
+)
 
-        num_rental_records = len(filtered_rental_data)
-        if num_rental_records > 0:
-            avg_rent_price = filtered_rental_data['annual_amount'].mean()
-        else:
-            avg_rent_price = 0
+@st.fragment
+def render_calculator():
+    """Time period, selection widgets, headline metrics and area comparison."""
+    months_back = st.select_slider(
+        'Time Period',
+        options=list(time_periods),
+        value=12,  
+        format_func=time_periods.get
+    )
 
-        if avg_rent_price > 0 and avg_sale_price > 0:
-            gross_rental_yield = (avg_rent_price / avg_sale_price) * 100
-        else:
-            gross_rental_yield = 0
-
-        metric_col1, metric_col2, metric_col3 = st.columns(3)
-
-        with metric_col1:
-            st.markdown(
-                f"""
-                <div style="background-color:#101726;padding:14px;border-radius:10px;text-align:center; margin:3px">
-                    <h3 style="color:#C8CAD0;font-size:25px;">Gross Rental Yield</h3>
-                    <p style="color:#C8CAD0;font-size:24px;">{gross_rental_yield:.2f}%</p>
-                </div>
-                """,
-                unsafe_allow_html=True
-            )
-        with metric_col2:
-            st.markdown(
-                f"""
-                <div style="background-color:#C8CAD0;padding:5px;border-radius:10px;text-align:center; margin:3px">
-                    <h3 style="color:#101726;">Avg. Sale Price</h3>
-                    <p style="color:#101726;font-size:24px;">AED {avg_sale_price:,.2f}</p>
-                    <p style="color:#101726;font-size:15px;">...based on {num_sales_records} sales.</p>
-                </div>
-                """,
-                unsafe_allow_html=True
-            )
+    col1, col2 = st.columns([1, 2])
 
-        with metric_col3:
-            st.markdown(
-                f"""
-                <div style="background-color:#C8CAD0;padding:5px;border-radius:10px;text-align:center; margin:3px">
-                    <h3 style="color:#101726;">Avg. Rent Price</h3>
-                    <p style="color:#101726;font-size:24px;">AED {avg_rent_price:,.2f}</p>
-                    <p style="color:#101726;font-size:15px;">...based on {num_rental_records} rental contracts.</p>
-                </div>
-                """,
-                unsafe_allow_html=True
-            )
+    with col1:
+        area_options = sales_data.index.categories.tolist()
+        default_index = area_options.index('Business Bay')
+        selected_area = st.selectbox("Select Area / Project:", area_options, index=default_index)
 
-st.subheader("Compare Rental Yields Across Multiple Areas")
+        property_type_options = sales_data['property_sub_type_en'].cat.categories.tolist()
+        selected_property_type = st.selectbox("Property Type:", property_type_options).strip() 
 
-selected_comparison_areas = st.multiselect("Select Area(s)/Project(s):", area_options, default=["Business Bay"])
+        rooms_options = sales_data['rooms_en'].cat.categories.tolist()
+        selected_rooms = st.selectbox("Rooms:", rooms_options, index=0).strip()  
 
-comparison_data = pd.DataFrame()
+    with col2:
+        metrics = compute_metrics(selected_area, selected_property_type, selected_rooms, months_back)
 
-for comparison_area in selected_comparison_areas:
-    comp_sales_data = sales_data[
-        (sales_data['master_project_en'] == comparison_area) &
-        (sales_data['property_sub_type_en'] == selected_property_type) &
-        (sales_data['rooms_en'] == selected_rooms) &
-        (sales_data['instance_date'] >= min_date)
-    ]
+        if metrics is None:
+            st.error("No sales or rental data available for the selected area, property type, or room type within the selected time period.")
+        else:
+            metric_col1, metric_col2, metric_col3 = st.columns(3)
 
-    comp_rental_data = rental_data[
-        (rental_data['master_project_en'] == comparison_area) &
-        (rental_data['ejari_property_type_en'] == selected_property_type) &
-        (rental_data['ejari_property_sub_type_id'] == selected_rooms) &
-        (rental_data['contract_start_date'] >= min_date)
-    ]
+            with metric_col1:
+                st.markdown(
+                    YIELD_CARD.substitute(gross_rental_yield=f"{metrics['gross_rental_yield']:.2f}"),
+                    unsafe_allow_html=True
+                )
+            with metric_col2:
+                st.markdown(
+                    SALE_PRICE_CARD.substitute(
+                        avg_sale_price=f"{metrics['avg_sale_price']:,.2f}",
+                        num_sales_records=metrics['num_sales_records']
+                    ),
+                    unsafe_allow_html=True
+                )
 
-    if not comp_sales_data.empty:
-        comp_sales_data = comp_sales_data.groupby(comp_sales_data['instance_date'].dt.to_period("M")).mean(numeric_only=True).reset_index()
-        comp_sales_data['instance_date'] = comp_sales_data['instance_date'].dt.to_timestamp()
-        comp_avg_sale_price = comp_sales_data['actual_worth'].mean()
-    else:
-        comp_avg_sale_price = 0
+            with metric_col3:
+                st.markdown(
+                    RENT_PRICE_CARD.substitute(
+                        avg_rent_price=f"{metrics['avg_rent_price']:,.2f}",
+                        num_rental_records=metrics['num_rental_records']
+                    ),
+                    unsafe_allow_html=True
+                )
 
-    if not comp_rental_data.empty:
-        comp_avg_rent_price = comp_rental_data['annual_amount'].mean()
-    else:
-        comp_avg_rent_price = 0
+    st.subheader("Compare Rental Yields Across Multiple Areas")
+
+    selected_comparison_areas = st.multiselect("Select Area(s)/Project(s):", area_options, default=["Business Bay"])
 
-    if comp_avg_rent_price > 0 and comp_avg_sale_price > 0:
-        comp_gross_rental_yield = (comp_avg_rent_price / comp_avg_sale_price) * 100
+    if not selected_comparison_areas:
+        st.info("Select at least one area to compare.")
     else:
-        comp_gross_rental_yield = 0
+        comparison_data = compute_comparison(
+            tuple(selected_comparison_areas),
+            selected_property_type,
+            selected_rooms,
+            months_back
+        )
 
-    if not comp_sales_data.empty:
-        comp_sales_data['Gross Rental Yield'] = (comp_avg_rent_price / comp_sales_data['actual_worth']) * 100
-        comp_sales_data['Area'] = comparison_area  # Add a column for area
-        comparison_data = pd.concat([comparison_data, comp_sales_data[['instance_date', 'Gross Rental Yield', 'Area']]])
+        if not comparison_data.empty:
+            st.line_chart(comparison_data, use_container_width=True)
 
-if not comparison_data.empty:
-    comparison_chart_data = comparison_data.pivot(index='instance_date', columns='Area', values='Gross Rental Yield')
-    st.line_chart(comparison_chart_data, use_container_width=True)
+render_calculator()
 
-st.write("*** Note: Data updated til 29 Oct. 2024 ***")
+st.write(f"*** Note: Data updated til {pd.Timestamp(DATA_VERSION):%d %b. %Y} ***")